@@ -1,5 +1,12 @@
+import asyncio
+import atexit
 import logging
-from datetime import time
+import logging.handlers
+import queue
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import os
 
@@ -9,15 +16,83 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup
 )
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     ContextTypes,
     CommandHandler,
     CallbackQueryHandler,
+    ExtBot,
     MessageHandler,
+    PicklePersistence,
+    Updater,
     filters,
 )
 
+# orjson (C-расширение) разбирает JSON в несколько раз быстрее stdlib json.
+# Зависимость опциональная: без неё работаем на стандартном парсере.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class _ORJSONRequest(HTTPXRequest):
+    """
+    HTTPXRequest с разбором ответов Telegram через orjson.
+    parse_json_payload — документированная точка переопределения в PTB;
+    основной выигрыш — на горячем пути декодирования getUpdates.
+    """
+
+    @staticmethod
+    def parse_json_payload(payload: bytes):
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            raise TelegramError("Invalid server response") from exc
+
+
+# Класс Request, который реально используем в main()
+_REQUEST_CLS = _ORJSONRequest if orjson is not None else HTTPXRequest
+
+
+class AdaptiveUpdater(Updater):
+    """
+    Updater с адаптивной паузой между запросами getUpdates: пока апдейты
+    приходят, следующий запрос уходит сразу; за каждый пустой ответ пауза
+    растёт на 50 мс (до потолка 5 с) и сбрасывается при первом же апдейте.
+    В простое трафик стремится к нулю, отзывчивость под нагрузкой не страдает.
+    """
+
+    __slots__ = ("_poll_delay",)
+
+    _EMPTY_STEP = 0.05  # прибавка за пустой ответ, сек
+    _DELAY_CAP = 5.0    # потолок паузы, сек
+
+    def __init__(self, bot, update_queue):
+        super().__init__(bot=bot, update_queue=update_queue)
+        self._poll_delay = 0.0
+
+    async def _network_loop_retry(self, action_cb, on_err_cb, description, interval):
+        # Пауза добавляется внутри колбэка опроса, поэтому логика ретраев
+        # родительского цикла не дублируется.
+        async def adaptive_action_cb():
+            if self._poll_delay:
+                await asyncio.sleep(self._poll_delay)
+            # О «пустом» ответе судим по росту очереди апдейтов:
+            # сам вызов getUpdates спрятан в замыкании PTB.
+            before = self.update_queue.qsize()
+            result = await action_cb()
+            if self.update_queue.qsize() > before:
+                self._poll_delay = 0.0
+            else:
+                self._poll_delay = min(self._poll_delay + self._EMPTY_STEP, self._DELAY_CAP)
+            return result
+
+        await super()._network_loop_retry(adaptive_action_cb, on_err_cb, description, interval)
+
 # НАСТРОЙКИ
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -25,51 +100,231 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN is not set in environment variables!")
 
+# Режим получения апдейтов: "webhook" (Telegram сам присылает события)
+# или "polling" (постоянные запросы getUpdates — запасной вариант).
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Публичный HTTPS-адрес для webhook-режима (например, от ngrok или nginx).
+PUBLIC_URL = os.getenv("PUBLIC_URL")
+
+# Порт, на котором слушаем входящие запросы от Telegram в webhook-режиме.
+WEBHOOK_PORT = int(os.getenv("PORT", 8443))
+
+# Файл, в который PicklePersistence сохраняет состояния пользователей,
+# чтобы рестарт процесса не терял настройки времени и ответы.
+STATE_FILE = os.getenv("STATE_FILE", "state.pkl")
+
 # Время по умолчанию (01:00 МСК), если пользователь не задал своё
 DEFAULT_HOUR = 1
 DEFAULT_MINUTE = 0
 
-# Имя задачи в JobQueue. 
-# Для удобства используем одно имя, но будем различать их по "data" (там chat_id).
-JOB_NAME = "daily_questions_job"
+# Часовой пояс бота. ZoneInfo читает и парсит tzdata при каждом создании,
+# поэтому держим один экземпляр на весь процесс.
+MSK = ZoneInfo("Europe/Moscow")
 
-# === ХРАНИЛИЩЕ СОСТОЯНИЙ ===
+# Ограничения хранилища состояний: не больше MAX_USERS записей,
+# неактивные дольше STALE_AFTER чаты вычищаются раз в неделю.
+MAX_USERS = int(os.getenv("MAX_USERS", 10000))
+STALE_AFTER = timedelta(days=30)
+
+# Имя единственной задачи-«тика» в JobQueue.
+# Вместо отдельной задачи на каждый chat_id одна задача раз в минуту
+# просматривает user_states и рассылает вопросы тем, у кого настало время.
+JOB_NAME = "daily_questions_tick"
 
-# user_states: словарь вида {chat_id: { ... }} — для каждого пользователя или группы своя запись.
-# Пример структуры для одного chat_id:
-# {
-#     "state": "idle" | "answering" | "waiting_for_tomorrow_goal",
-#     "answers": { "Цель на сегодня": None/'yes'/'no', ... },
-#     "messages": { "Цель на сегодня": <message_id>, ... },
-#     "send_hour": <int>,
-#     "send_minute": <int>
-# }
-user_states = {}
+# === ХРАНИЛИЩЕ СОСТОЯНИЙ ===
 
 # Список вопросов, которые бот задаёт
 QUESTIONS = ["Цель на сегодня", "Новое", "Развитие", "Спорт"]
 
 
+@dataclass(slots=True)
+class ChatState:
+    """
+    Состояние одного чата. slots=True и списки фиксированной длины вместо
+    вложенных словарей — заметно меньше памяти на запись при большом числе
+    пользователей. answers/message_ids индексируются номером вопроса в QUESTIONS.
+    """
+    state: str = "idle"  # "idle" | "answering" | "waiting_for_tomorrow_goal"
+    send_hour: int = DEFAULT_HOUR
+    send_minute: int = DEFAULT_MINUTE
+    answers: list = field(default_factory=lambda: [None] * len(QUESTIONS))
+    message_ids: list = field(default_factory=lambda: [0] * len(QUESTIONS))
+    answered: int = 0  # сколько вопросов уже отвечено — проверка полноты за O(1)
+    # Когда чат в последний раз что-то делал (команда/кнопка/текст) —
+    # по этому полю _cleanup_stale_users выкидывает заброшенные чаты.
+    last_seen: datetime = field(default_factory=lambda: datetime.now(MSK))
+
+
+class UserStore(OrderedDict):
+    """
+    OrderedDict с LRU-ограничением размера: новая запись уходит в конец,
+    при переполнении выталкивается самая старая. Память хранилища остаётся
+    ограниченной, сколько бы чатов ни заходило за время жизни процесса.
+    """
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > MAX_USERS:
+            evicted_chat_id, _ = self.popitem(last=False)
+            # Вместе с состоянием выбрасываем и блокировку рассылки,
+            # иначе _send_locks растёт без ограничения.
+            _send_locks.pop(evicted_chat_id, None)
+
+
+# Защита от двух одновременных рассылок в один чат (например, дубликат
+# «тика» при подвисшей отправке). Блокировки живут отдельно от ChatState,
+# потому что asyncio.Lock не пиклится persistence-ом.
+# Чистится вместе с user_states (LRU-вытеснение и _cleanup_stale_users).
+_send_locks = {}
+
+# user_states: словарь вида {chat_id: ChatState} — для каждого пользователя
+# или группы своя запись.
+# При старте заменяется на хранилище из application.bot_data["users"]
+# (см. _restore_user_states), которое PicklePersistence сохраняет на диск.
+user_states = UserStore()
+
+# Клавиатуры неизменны, поэтому собираем их один раз при импорте,
+# а не на каждую рассылку/нажатие. callback_data — три символа "<idx>:<y|n>":
+# номер вопроса и ответ читаются прямой индексацией строки, без split.
+# (Предполагается len(QUESTIONS) < 10 — номер занимает один символ.)
+QUESTION_MARKUPS = [
+    InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("❌", callback_data=f"{idx}:n"),
+            InlineKeyboardButton("✅", callback_data=f"{idx}:y")
+        ]
+    ])
+    for idx in range(len(QUESTIONS))
+]
+
+# Клавиатуры «выбор сделан» — остаётся одна нажатая кнопка
+CHOSEN_YES_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("✅", callback_data="chosen")]])
+CHOSEN_NO_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("❌", callback_data="chosen")]])
+
+
 def main():
     """
     Точка входа. «Синхронный» запуск бота (application.run_polling())
     без дополнительного asyncio.run(...).
     """
+    # Логи уходят в очередь, а пишет их в stderr фоновый поток QueueListener:
+    # обработчики в event loop не блокируются на записи (Docker/journald
+    # бывают медленными).
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log_listener.start()
+    # При выходе дописываем то, что осталось в очереди (в т.ч. финальные
+    # сообщения PTB при остановке), иначе они молча пропадут.
+    atexit.register(log_listener.stop)
     logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.handlers.QueueHandler(log_queue)],
         level=logging.INFO
     )
 
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    # Бот собирается вручную, потому что builder не позволяет одновременно
+    # задать token/request и свой Updater (AdaptiveUpdater ниже).
+    # Большой пул соединений + HTTP/2: утренняя рассылка (gather по 4
+    # сообщения на чат) мультиплексируется по одному соединению вместо
+    # новых TCP+TLS-рукопожатий на каждый запрос. Для getUpdates — отдельный
+    # небольшой пул; read_timeout=60 — дольше, чем длится long-poll (timeout=50 ниже).
+    bot = ExtBot(
+        token=TELEGRAM_BOT_TOKEN,
+        request=_REQUEST_CLS(
+            connection_pool_size=64,
+            http_version="2",
+            read_timeout=20,
+            write_timeout=20,
+        ),
+        get_updates_request=_REQUEST_CLS(
+            connection_pool_size=8,
+            http_version="2",
+            read_timeout=60,
+        ),
+    )
 
-    # Регистрируем обработчики
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("settime", settime_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    application = (
+        ApplicationBuilder()
+        # Адаптивный backoff опроса: см. AdaptiveUpdater
+        .updater(AdaptiveUpdater(bot=bot, update_queue=asyncio.Queue()))
+        # Состояния пользователей переживают рестарт процесса
+        .persistence(PicklePersistence(filepath=STATE_FILE))
+        .post_init(_restore_user_states)
+        .build()
+    )
 
-    # Запускаем бота блокирующим методом
-    application.run_polling()
+    # Регистрируем обработчики.
+    # block=False: каждый апдейт обрабатывается отдельной задачей, поэтому
+    # медленный запрос для одного чата не тормозит остальные чаты.
+    application.add_handler(CommandHandler("start", start_command, block=False))
+    application.add_handler(CommandHandler("settime", settime_command, block=False))
+    application.add_handler(CallbackQueryHandler(button_callback, block=False))
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND & _WaitingGoalFilter(),
+            message_handler,
+            block=False,
+        )
+    )
+
+    # Одна задача-«тик» раз в минуту вместо отдельной daily-задачи на каждый
+    # чат: память планировщика не растёт с числом пользователей.
+    application.job_queue.run_repeating(_tick, interval=60, first=0, name=JOB_NAME)
+
+    # Еженедельная чистка заброшенных чатов — память ограничена при
+    # любом сроке работы процесса.
+    application.job_queue.run_repeating(
+        _cleanup_stale_users,
+        interval=timedelta(days=7),
+        first=timedelta(days=7),
+        name="stale_users_cleanup",
+    )
+
+    # Запускаем бота блокирующим методом.
+    # Webhook выгоднее: Telegram присылает апдейты сам, без постоянных
+    # getUpdates-запросов. Polling оставлен как запасной режим.
+    if BOT_MODE == "webhook":
+        if not PUBLIC_URL:
+            raise ValueError("PUBLIC_URL is not set — it is required for webhook mode!")
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{PUBLIC_URL}/{TELEGRAM_BOT_TOKEN}",
+        )
+    else:
+        # Длинный long-poll (timeout=50) вместо частых коротких запросов:
+        # Telegram держит соединение открытым и отвечает сразу при появлении
+        # апдейта, так что в простое уходит ~1 запрос в минуту вместо сотен.
+        # allowed_updates ограничен двумя типами, которые бот реально обрабатывает.
+        application.run_polling(
+            timeout=50,
+            poll_interval=0.0,
+            bootstrap_retries=-1,
+            allowed_updates=["message", "callback_query"],
+        )
+
+
+async def _restore_user_states(application: Application):
+    """
+    Вызывается один раз после загрузки persistence.
+    Подменяем модульный user_states хранилищем из bot_data["users"]:
+    все обработчики продолжают работать с ним как раньше, а
+    PicklePersistence периодически сбрасывает его на диск.
+    """
+    global user_states
+    restored = application.bot_data.get("users")
+    if restored is not None and not isinstance(restored, UserStore):
+        # Состояние из старой версии бота (обычный dict) — оборачиваем в LRU
+        restored = UserStore(restored)
+    if restored is not None:
+        user_states = restored
+    application.bot_data["users"] = user_states
 
 
 # === ОБРАБОТЧИКИ КОМАНД ===
@@ -77,20 +332,15 @@ def main():
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /start — инициализация (или переинициализация) для текущего chat_id.
-    Задаём дефолтное время (либо берём уже сохранённое), 
-    создаём/обновляем ежедневную задачу в JobQueue.
+    Задаём дефолтное время (либо берём уже сохранённое); рассылкой займётся
+    общая задача-«тик», отдельную job создавать не нужно.
     """
     chat_id = update.effective_chat.id
 
     # Инициализируем запись в user_states, если ещё нет
-    user_data = user_states.setdefault(chat_id, {})
-    user_data.setdefault("state", "idle")
-    user_data.setdefault("send_hour", DEFAULT_HOUR)
-    user_data.setdefault("send_minute", DEFAULT_MINUTE)
-
-    # Удаляем предыдущее задание (если было) и ставим новое
-    _remove_existing_job(context, JOB_NAME, chat_id)
-    _add_daily_job(context, chat_id, user_data["send_hour"], user_data["send_minute"])
+    # (ChatState сам задаёт дефолтное состояние и время)
+    user_data = user_states.setdefault(chat_id, ChatState())
+    user_data.last_seen = datetime.now(MSK)
 
     await update.message.reply_text(
         "Привет! Я бот, который каждый день в назначенное время будет задавать 4 вопроса:\n"
@@ -104,36 +354,44 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Формат «ЧЧ:ММ» с проверкой диапазонов прямо в регулярке:
+# кривой ввод отсеивается без исключений и int()-проб.
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]?\d)$")
+
+
+def _parse_time(time_str):
+    """
+    Разбирает строку «ЧЧ:ММ». Возвращает (hour, minute) либо None,
+    если формат или диапазон неверный.
+    """
+    m = _TIME_RE.match(time_str)
+    if not m:
+        return None
+    return int(m[1]), int(m[2])
+
+
 async def settime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /settime ЧЧ:ММ — установить или изменить время ежедневной рассылки вопросов для текущего chat_id.
     """
     chat_id = update.effective_chat.id
-    user_data = user_states.setdefault(chat_id, {})
+    user_data = user_states.setdefault(chat_id, ChatState())
+    user_data.last_seen = datetime.now(MSK)
 
     # Проверяем аргументы
     if len(context.args) != 1:
         await update.message.reply_text("Формат команды: /settime ЧЧ:ММ (например, /settime 02:30).")
         return
 
-    time_str = context.args[0]
-    try:
-        hour_str, minute_str = time_str.split(":")
-        hour = int(hour_str)
-        minute = int(minute_str)
-        if not (0 <= hour < 24 and 0 <= minute < 60):
-            raise ValueError("Неверное время")
-    except:
+    parsed = _parse_time(context.args[0])
+    if parsed is None:
         await update.message.reply_text("Неверный формат времени. Пример: /settime 02:30")
         return
+    hour, minute = parsed
 
-    # Сохраняем в user_data
-    user_data["send_hour"] = hour
-    user_data["send_minute"] = minute
-
-    # Удаляем старую job, ставим новую
-    _remove_existing_job(context, JOB_NAME, chat_id)
-    _add_daily_job(context, chat_id, hour, minute)
+    # Сохраняем в user_data — задача-«тик» подхватит новое время сама
+    user_data.send_hour = hour
+    user_data.send_minute = minute
 
     await update.message.reply_text(
         f"Новое время ежедневной рассылки установлено: {hour:02d}:{minute:02d} (МСК)."
@@ -147,114 +405,161 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Обработка нажатий на inline-кнопки (❌ / ✅).
     """
     query = update.callback_query
-    await query.answer()  # убираем "loading..."
+    # Убираем "loading..." фоновой задачей: не ждём лишний round-trip
+    # перед обработкой, а на ранних return задача доработает сама.
+    answer_task = asyncio.create_task(query.answer())
+    # Ранние return бросают задачу без await: забираем возможную ошибку
+    # answer() (TimedOut и т.п.), чтобы asyncio не заспамил лог
+    # трейсбеками «Task exception was never retrieved».
+    answer_task.add_done_callback(
+        lambda task: None if task.cancelled() else task.exception()
+    )
 
     chat_id = query.message.chat_id
     user_data = user_states.get(chat_id)
-    if not user_data or user_data.get("state") != "answering":
+    if not user_data or user_data.state != "answering":
         return  # Игнорируем, если не в нужном состоянии
 
-    data = query.data  # Например "Цель на сегодня|yes" или "Спорт|no"
-    question, answer = data.split("|")
+    data = query.data  # Например "0:y" или "3:n"
+    if len(data) != 3 or data[1] != ":":
+        return  # служебные callback_data вроде "chosen"
+    idx = int(data[0])
+    answer = data[2]  # "y" или "n"
 
     # Проверим, не ответил ли уже юзер на этот вопрос
-    if user_data["answers"].get(question) is not None:
+    if user_data.answers[idx] is not None:
         return  # уже есть ответ — игнорируем повторные клики
 
     # Сохраняем ответ
-    user_data["answers"][question] = answer
+    user_data.answers[idx] = answer
+    user_data.answered += 1
+    user_data.last_seen = datetime.now(MSK)
 
-    # Редактируем кнопки: оставляем только ту, на которую нажали (❌ или ✅)
-    if answer == "yes":
-        new_keyboard = [[InlineKeyboardButton("✅", callback_data="chosen")]]
-    else:
-        new_keyboard = [[InlineKeyboardButton("❌", callback_data="chosen")]]
+    # Редактируем кнопки: оставляем только ту, на которую нажали (❌ или ✅).
+    # answer() и edit_reply_markup() уходят в сеть одновременно —
+    # пользователь видит реакцию за один round-trip вместо двух.
+    markup = CHOSEN_YES_MARKUP if answer == "y" else CHOSEN_NO_MARKUP
 
     try:
-        await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(new_keyboard))
-    except:
+        await asyncio.gather(
+            answer_task,
+            query.message.edit_reply_markup(reply_markup=markup),
+        )
+    except BadRequest:
+        # Например, «message is not modified» при гонке кликов — не страшно.
+        # Сетевые ошибки (TimedOut и т.п.) нарочно не глушим.
         pass
 
     # Если все 4 вопроса уже отвечены, переходим к "Цель на завтра"
-    if all(v is not None for v in user_data["answers"].values()):
-        user_data["state"] = "waiting_for_tomorrow_goal"
+    if user_data.answered == len(QUESTIONS):
+        user_data.state = "waiting_for_tomorrow_goal"
         await context.bot.send_message(chat_id, "Цель на завтра?")
 
 
 # === ОБРАБОТЧИК СООБЩЕНИЙ (ТЕКСТ) ===
 
+class _WaitingGoalFilter(filters.MessageFilter):
+    """
+    Пропускает текст только от чатов в состоянии "waiting_for_tomorrow_goal".
+    Посторонние сообщения (особенно в группах) отсеиваются ещё в диспетчере,
+    без планирования корутины-обработчика на каждое из них.
+    """
+
+    def filter(self, message):
+        user_data = user_states.get(message.chat_id)
+        return bool(user_data and user_data.state == "waiting_for_tomorrow_goal")
+
+
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Обрабатываем все текстовые сообщения (кроме команд).
-    Если пользователь в состоянии "waiting_for_tomorrow_goal", считаем этот текст «целью на завтра».
+    Принимает «цель на завтра»: благодаря _WaitingGoalFilter сюда попадает
+    только текст от чата в состоянии "waiting_for_tomorrow_goal".
     """
     chat_id = update.effective_chat.id
     user_data = user_states.get(chat_id)
     if not user_data:
         return
 
-    if user_data.get("state") == "waiting_for_tomorrow_goal":
-        goal_text = update.message.text
-        logging.info(f"[{chat_id}] Цель на завтра: {goal_text}")
+    goal_text = update.message.text
+    # Ленивая %s-подстановка: строка не собирается, если уровень выключен
+    logging.info("[%s] Цель на завтра: %s", chat_id, goal_text)
 
-        # Меняем состояние на idle
-        user_data["state"] = "idle"
-        await update.message.reply_text("Цель на завтра принята! Жду тебя завтра в назначенное время.")
+    # Меняем состояние на idle
+    user_data.state = "idle"
+    user_data.last_seen = datetime.now(MSK)
+    await update.message.reply_text("Цель на завтра принята! Жду тебя завтра в назначенное время.")
 
 
-# === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ JOBQUEUE ===
+# === ЕЖЕМИНУТНЫЙ «ТИК» И РАССЫЛКА ВОПРОСОВ ===
 
-def _remove_existing_job(context: ContextTypes.DEFAULT_TYPE, job_name: str, chat_id: int):
+async def _tick(context: ContextTypes.DEFAULT_TYPE):
     """
-    Удаляем из JobQueue все задачи с именем job_name и data=chat_id (если такие есть).
-    Это нужно, чтобы не было дублей при изменении времени.
+    Вызывается JobQueue раз в минуту. Проходит по всем записям user_states
+    и запускает рассылку вопросов для чатов, у которых настало их время (МСК).
     """
-    current_jobs = context.job_queue.get_jobs_by_name(job_name)
-    for job in current_jobs:
-        if job.data == chat_id:
-            job.schedule_removal()
+    now = datetime.now(MSK)
+    for chat_id, user_data in user_states.items():
+        if user_data.send_hour == now.hour and user_data.send_minute == now.minute:
+            # Отдельная задача на каждый чат: медленная отправка одному
+            # не задерживает остальных и сам «тик».
+            asyncio.create_task(send_daily_questions(chat_id, context))
 
 
-def _add_daily_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int, hour: int, minute: int):
+async def _cleanup_stale_users(context: ContextTypes.DEFAULT_TYPE):
     """
-    Добавляем в JobQueue новое задание, которое будет срабатывать каждый день в hour:minute (MSK).
+    Удаляет записи чатов, которые дольше STALE_AFTER ничего не делали
+    и сейчас не посреди опроса. Вернувшийся пользователь просто сделает
+    /start заново.
     """
-    context.job_queue.run_daily(
-        send_daily_questions, 
-        time=time(hour=hour, minute=minute, tzinfo=ZoneInfo("Europe/Moscow")),
-        days=(0, 1, 2, 3, 4, 5, 6),  # все дни недели
-        name=JOB_NAME,               # имя задачи
-        data=chat_id                 # в data храним chat_id, чтобы знать, кому отправлять
-    )
-
-
-# === ФУНКЦИЯ, КОТОРУЮ ВЫЗЫВАЕТ JOBQUEUE КАЖДЫЙ ДЕНЬ ===
-
-async def send_daily_questions(context: ContextTypes.DEFAULT_TYPE):
+    cutoff = datetime.now(MSK) - STALE_AFTER
+    stale = [
+        chat_id
+        for chat_id, user_data in user_states.items()
+        if user_data.state == "idle" and user_data.last_seen < cutoff
+    ]
+    for chat_id in stale:
+        del user_states[chat_id]
+        _send_locks.pop(chat_id, None)
+    if stale:
+        logging.info("Удалено неактивных чатов: %d", len(stale))
+
+
+async def send_daily_questions(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     """
-    Вызывается JobQueue в установленное время (для каждого chat_id своё).
-    Отправляет 4 вопроса с кнопками.
+    Отправляет 4 вопроса с кнопками в указанный чат.
+    Повторный вызов, пока рассылка в этот чат ещё идёт, молча игнорируется —
+    иначе две копии затирали бы answers/message_ids друг друга и слали
+    дублирующие сообщения. Состояние "answering" нарочно не проверяем:
+    если вчерашний опрос остался без ответов, сегодняшний должен уйти.
     """
-    chat_id = context.job.data
-    user_data = user_states.setdefault(chat_id, {})
-
-    user_data["state"] = "answering"
-    user_data["answers"] = {q: None for q in QUESTIONS}
-    user_data["messages"] = {}
-
-    for question in QUESTIONS:
-        keyboard = [
-            [
-                InlineKeyboardButton("❌", callback_data=f"{question}|no"),
-                InlineKeyboardButton("✅", callback_data=f"{question}|yes")
-            ]
-        ]
-        msg = await context.bot.send_message(
-            chat_id=chat_id,
-            text=question,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        user_data["messages"][question] = msg.message_id
+    lock = _send_locks.setdefault(chat_id, asyncio.Lock())
+    if lock.locked():
+        return  # рассылка в этот чат уже в полёте
+
+    async with lock:
+        user_data = user_states.setdefault(chat_id, ChatState())
+
+        user_data.state = "answering"
+        # Сбрасываем списки на месте: ChatState уже держит буферы нужной
+        # длины, новые выделять на каждую рассылку незачем.
+        for idx in range(len(QUESTIONS)):
+            user_data.answers[idx] = None
+            user_data.message_ids[idx] = 0
+        user_data.answered = 0
+
+        # Отправляем все 4 вопроса одновременно, а не по очереди —
+        # 1 сетевая задержка вместо 4. Порядок результатов gather совпадает
+        # с порядком QUESTIONS, так что message_id раскладываются корректно.
+        msgs = await asyncio.gather(*(
+            context.bot.send_message(
+                chat_id=chat_id,
+                text=QUESTIONS[idx],
+                reply_markup=QUESTION_MARKUPS[idx]
+            )
+            for idx in range(len(QUESTIONS))
+        ))
+        for idx, msg in enumerate(msgs):
+            user_data.message_ids[idx] = msg.message_id
 
 
 # Запуск